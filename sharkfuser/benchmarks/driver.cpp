@@ -10,15 +10,23 @@
 
 #include <CLI/CLI.hpp>
 
+#include <chrono>
 #include <cstddef>
 #include <cstdint>
+#include <cstdlib>
+#include <ctime>
 #include <exception>
 #include <format>
+#include <future>
 #include <iostream>
 #include <limits>
 #include <memory>
+#include <sstream>
+#include <string>
 #include <string_view>
+#include <thread>
 #include <unordered_map>
+#include <utility>
 #include <vector>
 
 using namespace fusilli;
@@ -31,6 +39,16 @@ const auto kIsPositiveInteger =
 const auto kIsValidConvLayout =
     CLI::IsMember({"NCHW", "NHWC", "NCDHW", "NDHWC"});
 
+// Printed to stdout after each configuration in batch mode, followed by the
+// exit status and the start/end timestamps of that configuration. The runner
+// script uses it to attribute kernel dispatches from a single rocprofv3
+// session to the configuration that issued them.
+constexpr std::string_view kBatchDelimiter = "FUSILLI_BATCH_DELIMITER";
+
+// Exit status reported in batch mode for a configuration that exceeded the
+// per-configuration timeout (same as coreutils' `timeout`).
+constexpr int kBatchTimeoutStatus = 124;
+
 static ErrorObject
 benchmarkConvFprop(int64_t n, int64_t c, int64_t d, int64_t h, int64_t w,
                    int64_t g, int64_t k, int64_t z, int64_t y, int64_t x,
@@ -572,7 +590,7 @@ static int benchmark(int argc, char **argv) {
   return 0;
 }
 
-int main(int argc, char **argv) {
+static int runBenchmark(int argc, char **argv) {
   try {
     return benchmark(argc, argv);
   } catch (const std::exception &e) {
@@ -583,3 +601,79 @@ int main(int argc, char **argv) {
     return 1;
   }
 }
+
+// Timestamps in the same clock domain as rocprofv3 kernel traces
+// (CLOCK_BOOTTIME, in nanoseconds).
+static uint64_t getTimestampNs() {
+  timespec ts;
+  clock_gettime(CLOCK_BOOTTIME, &ts);
+  return static_cast<uint64_t>(ts.tv_sec) * 1000000000ull +
+         static_cast<uint64_t>(ts.tv_nsec);
+}
+
+// Runs one configuration per line read from stdin (same arguments as a
+// regular invocation, without the program name) so that a single profiler
+// session can cover many configurations. Each configuration runs on its own
+// thread; if one exceeds `timeout` seconds (-1 for no timeout), it is reported
+// with kBatchTimeoutStatus and the process exits immediately, leaving the
+// remaining configurations for the caller to run in a new session.
+static int benchmarkBatch(char *programName, int64_t timeout) {
+  int failures = 0;
+  std::string line;
+  while (std::getline(std::cin, line)) {
+    std::vector<std::string> tokens;
+    std::istringstream stream(line);
+    for (std::string token; stream >> token;)
+      tokens.push_back(token);
+    if (tokens.empty())
+      continue;
+
+    std::packaged_task<int()> task(
+        [programName, tokens = std::move(tokens)]() mutable {
+          std::vector<char *> args = {programName};
+          for (auto &token : tokens)
+            args.push_back(token.data());
+          return runBenchmark(static_cast<int>(args.size()), args.data());
+        });
+    std::future<int> result = task.get_future();
+
+    uint64_t start = getTimestampNs();
+    std::thread worker(std::move(task));
+    if (timeout >= 0 && result.wait_for(std::chrono::seconds(timeout)) !=
+                            std::future_status::ready) {
+      // A hung configuration can't be cancelled, and leaving it running would
+      // leak its dispatches and output into later configurations. Report it
+      // and exit without running exit handlers or static destructors, which
+      // are unsafe while the worker is still inside the runtime.
+      std::cout << kBatchDelimiter << " " << kBatchTimeoutStatus << " " << start
+                << " " << getTimestampNs() << std::endl;
+      std::cerr << "Configuration timed out after " << timeout << " seconds."
+                << std::endl;
+      std::_Exit(kBatchTimeoutStatus);
+    }
+    worker.join();
+    int status = result.get();
+    uint64_t end = getTimestampNs();
+    if (status != 0)
+      failures++;
+
+    std::cout << kBatchDelimiter << " " << status << " " << start << " " << end
+              << std::endl;
+  }
+  return failures == 0 ? 0 : 1;
+}
+
+int main(int argc, char **argv) {
+  if (argc >= 2 && std::string_view(argv[1]) == "--batch") {
+    CLI::App batchApp{"Fusilli Benchmark Driver (batch mode)"};
+    int64_t timeout = -1;
+    batchApp.add_flag("--batch", "Read one configuration per line from stdin");
+    batchApp
+        .add_option("--timeout", timeout,
+                    "Per-configuration timeout in seconds (-1 for no timeout)")
+        ->check(CLI::Range(int64_t{-1}, std::numeric_limits<int64_t>::max()));
+    CLI11_PARSE(batchApp, argc, argv);
+    return benchmarkBatch(argv[0], timeout);
+  }
+  return runBenchmark(argc, argv);
+}
@@ -6,16 +6,21 @@
 # SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
 
 import argparse
+import bisect
+import concurrent.futures
+import contextlib
 import csv
 import glob
+import itertools
+import math
+import multiprocessing
 import os
 import shlex
-import statistics
 import subprocess
 import sys
 import tempfile
 from pathlib import Path
-from typing import NamedTuple
+from typing import Iterator, NamedTuple
 
 
 class TimingStats(NamedTuple):
@@ -35,44 +40,115 @@ class CommandResult(NamedTuple):
     succeeded: bool = False
 
 
-ALL_METRICS = ["min", "max", "mean", "stddev", "iter", "dispatch_count"]
-
+class RocprofInvocation(NamedTuple):
+    # The invariant parts of a rocprofv3 command line, which go before and
+    # after the per-run output directory respectively. `tail` ends with the
+    # driver, so that driver arguments can be appended to it.
+    head: list[str]
+    tail: list[str]
 
-def parse_rocprof_csv(output_dir: Path, iter_count: int) -> TimingStats:
-    kernel_trace_files = list(output_dir.rglob("*kernel_trace.csv"))
 
-    if not kernel_trace_files:
-        return TimingStats()
-
-    durations = []
+ALL_METRICS = ["min", "max", "mean", "stddev", "iter", "dispatch_count"]
 
-    for csv_file in kernel_trace_files:
+SKIP_PREFIX = "[SKIP]"
+
+# Output CSV rows are accumulated and written out every CSV_FLUSH_INTERVAL
+# commands through a CSV_BUFFER_SIZE-byte buffer.
+CSV_FLUSH_INTERVAL = 16
+CSV_BUFFER_SIZE = 1 << 20
+
+PROFILE_MODES = ["timing", "counters"]
+
+# rocprofv3 options that add host API tracing on top of kernel tracing.
+API_TRACE_ARGS = [
+    "--runtime-trace",
+    "-r",
+    "--sys-trace",
+    "-s",
+    "--hip-trace",
+    "--hip-runtime-trace",
+    "--hip-compiler-trace",
+    "--hsa-trace",
+    "--hsa-core-trace",
+    "--hsa-amd-trace",
+    "--hsa-image-trace",
+    "--hsa-finalizer-trace",
+    "--marker-trace",
+    "--rccl-trace",
+    "--kokkos-trace",
+    "--rocdecode-trace",
+    "--rocjpeg-trace",
+]
+
+# rocprofv3 options that collect hardware counters, thread traces or PC
+# samples, which serialize dispatches even more than API tracing. Matched as
+# prefixes, e.g. "--att" also covers "--att-target-cu".
+COUNTER_ARG_PREFIXES = ["--pmc", "--att", "--pc-sampling"]
+
+# Must match kBatchDelimiter and kBatchTimeoutStatus in driver.cpp.
+BATCH_DELIMITER = "FUSILLI_BATCH_DELIMITER"
+BATCH_TIMEOUT_STATUS = 124
+
+
+def find_kernel_trace_files(output_dir: str) -> Iterator[str]:
+    # rocprofv3 writes traces at the top level of --output-directory (or one
+    # level below, e.g. per host), so a plain scandir walk avoids the pathlib
+    # overhead of rglob. Files are yielded lazily as they are found.
+    pending = [output_dir]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.name.endswith("kernel_trace.csv"):
+                    yield entry.path
+
+
+def read_kernel_dispatches(output_dir: str) -> list[tuple[int, int]]:
+    """Returns (start, end) timestamps in nanoseconds of all async dispatches.
+
+    Dispatches from all trace shards (e.g. one per agent) are merged and sorted
+    by start time, so consecutive entries belong to the same iteration.
+    """
+    kernel_trace_files = find_kernel_trace_files(output_dir)
+
+    # Bail out before setting up any parsing if rocprofv3 wrote no trace.
+    first_file = next(kernel_trace_files, None)
+    if first_file is None:
+        return []
+
+    dispatches = []
+
+    for csv_file in itertools.chain([first_file], kernel_trace_files):
         try:
-            with open(csv_file, "r") as f:
-                reader = csv.DictReader(f)
-                # Each row represents a single kernel dispatch
-                for row in reader:
-                    # Sometimes, we may see non-async_dispatch rows in the CSV file.
-                    # It is not consistently reproducible, so we have this check
-                    # to filter out non-async_dispatch rows.
-                    has_async_dispatch = any(
-                        "async_dispatch" in str(value).lower() for value in row.values()
-                    )
-                    if (
-                        has_async_dispatch
-                        and "Start_Timestamp" in row
-                        and "End_Timestamp" in row
-                    ):
-                        start = float(row["Start_Timestamp"])
-                        end = float(row["End_Timestamp"])
-                        # Convert from nanoseconds to microseconds
-                        duration_us = (end - start) / 1000.0
-                        durations.append(duration_us)
+            with open(csv_file, "r", newline="") as f:
+                reader = csv.reader(f)
+                # Only the kernel name and the timestamps are needed, so index
+                # them positionally instead of building a dict per row.
+                header = next(reader, [])
+                columns = ("Kernel_Name", "Start_Timestamp", "End_Timestamp")
+                if any(column not in header for column in columns):
+                    continue
+                name_idx, start_idx, end_idx = map(header.index, columns)
+                # Each row represents a single kernel dispatch.
+                # Sometimes, we may see non-async_dispatch rows in the CSV file.
+                # It is not consistently reproducible, so we have this check
+                # to filter out non-async_dispatch rows.
+                dispatches.extend(
+                    (int(row[start_idx]), int(row[end_idx]))
+                    for row in reader
+                    if "async_dispatch" in row[name_idx].lower()
+                )
         except Exception as e:
             raise RuntimeError(
                 f"Failed to parse rocprof CSV file {csv_file}: {e}"
             ) from e
 
+    dispatches.sort()
+    return dispatches
+
+
+def compute_timing_stats(durations: list[float], iter_count: int) -> TimingStats:
     if not durations:
         return TimingStats()
 
@@ -85,24 +161,23 @@ def parse_rocprof_csv(output_dir: Path, iter_count: int) -> TimingStats:
             total_dispatches % iter_count == 0
         ), "Total dispatches must be divisible by iter_count"
         dispatches_per_iter = total_dispatches // iter_count
-        # Group consecutive dispatches into iterations and sum their durations
-        iteration_durations = []
+        # Group consecutive dispatches into iterations, sum their durations and
+        # accumulate statistics across iterations in a single pass (Welford's
+        # algorithm for mean and variance).
+        min_time = float("inf")
+        max_time = float("-inf")
+        mean_time = 0.0
+        sum_sq_diff = 0.0
         for i in range(iter_count):
             start_idx = i * dispatches_per_iter
-            end_idx = start_idx + dispatches_per_iter
-            iter_sum = sum(durations[start_idx:end_idx])
-            iteration_durations.append(iter_sum)
-
-        # Compute statistics across iterations
-        min_time = min(iteration_durations)
-        max_time = max(iteration_durations)
-        mean_time = statistics.mean(iteration_durations)
-        stddev = (
-            statistics.stdev(iteration_durations)
-            if len(iteration_durations) > 1
-            else 0.0
-        )
-        iter_count_result = len(iteration_durations)
+            iter_sum = sum(durations[start_idx : start_idx + dispatches_per_iter])
+            min_time = min(min_time, iter_sum)
+            max_time = max(max_time, iter_sum)
+            delta = iter_sum - mean_time
+            mean_time += delta / (i + 1)
+            sum_sq_diff += delta * (iter_sum - mean_time)
+        stddev = math.sqrt(sum_sq_diff / (iter_count - 1)) if iter_count > 1 else 0.0
+        iter_count_result = iter_count
         dispatch_count = dispatches_per_iter
     else:
         raise RuntimeError(
@@ -119,13 +194,67 @@ def parse_rocprof_csv(output_dir: Path, iter_count: int) -> TimingStats:
     )
 
 
+def parse_rocprof_csv(output_dir: str, iter_count: int) -> TimingStats:
+    # Convert from nanoseconds to microseconds
+    durations = [
+        (end - start) / 1000.0 for start, end in read_kernel_dispatches(output_dir)
+    ]
+    return compute_timing_stats(durations, iter_count)
+
+
+def get_iter_count(driver_args: list[str]) -> int:
+    iter_count = 1
+    if "--iter" in driver_args:
+        iter_idx = driver_args.index("--iter")
+        if iter_idx + 1 < len(driver_args):
+            iter_count = int(driver_args[iter_idx + 1])
+    return iter_count
+
+
+def print_stats(stats: TimingStats) -> None:
+    print(
+        f">>> Stats: min={stats.min:.2f}(us), max={stats.max:.2f}(us), mean={stats.mean:.2f}(us), iter={stats.iter}, dispatch_count={stats.dispatch_count}"
+    )
+
+
+def print_result(result: CommandResult) -> None:
+    if result.succeeded:
+        print_stats(result.stats)
+    elif result.skipped:
+        print(">>> Skipped")
+    elif result.timed_out:
+        print(">>> Timed out")
+    elif result.failed:
+        print(">>> Failed")
+    else:
+        raise RuntimeError(f"Unknown result: {result}")
+
+
+def print_banner(header: str, command: str) -> None:
+    if command.startswith(SKIP_PREFIX):
+        command = command[len(SKIP_PREFIX) :].strip()
+    print(f"\n{'='*80}")
+    print(f"{header}:\n{command}")
+    print(f"{'='*80}")
+
+
+def build_rocprof_cmd(
+    rocprof: RocprofInvocation, output_dir: str, driver_args: list[str]
+) -> list[str]:
+    return [
+        *rocprof.head,
+        "--output-directory",
+        output_dir,
+        *rocprof.tail,
+        *driver_args,
+    ]
+
+
 def run_profiled_command(
     command: str,
-    driver_path: str,
-    output_dir: Path | None,
-    rocprof_args: list[str],
+    rocprof: RocprofInvocation,
+    cmd_output_dir: str | None,
     verbose: bool,
-    cmd_num: int,
     timeout: int,
 ) -> CommandResult:
 
@@ -135,56 +264,39 @@ def run_profiled_command(
             print(f">>> Failed to parse command: {command}")
         return CommandResult(TimingStats(), failed=True)
 
-    iter_count = 1
-    if "--iter" in driver_args:
-        iter_idx = driver_args.index("--iter")
-        if iter_idx + 1 < len(driver_args):
-            iter_count = int(driver_args[iter_idx + 1])
-
-    driver_cmd = [driver_path] + driver_args
+    iter_count = get_iter_count(driver_args)
 
-    # Use either temporary directory or persistent directory
-    if output_dir is None:
+    # Use either temporary directory or persistent directory (created by main)
+    if cmd_output_dir is None:
         tmpdir_context = tempfile.TemporaryDirectory()
-        cmd_output_dir = Path(tmpdir_context.__enter__())
+        cmd_output_dir = tmpdir_context.__enter__()
     else:
         tmpdir_context = None
-        cmd_output_dir = output_dir / f"command_{cmd_num}"
-        cmd_output_dir.mkdir(parents=True, exist_ok=True)
 
     try:
-        rocprof_cmd = (
-            [
-                "rocprofv3",
-                "--output-format",
-                "csv",
-                "--output-directory",
-                str(cmd_output_dir),
-            ]
-            + rocprof_args
-            + ["--"]
-            + driver_cmd
-        )
+        rocprof_cmd = build_rocprof_cmd(rocprof, cmd_output_dir, driver_args)
 
         if verbose:
-            print(f">>> {shlex.join(rocprof_cmd)}\n")
+            # Flush so our output is not reordered after the subprocess's.
+            print(f">>> {shlex.join(rocprof_cmd)}\n", flush=True)
 
+        # stdout is only shown in verbose mode, so stream it straight through
+        # (or discard it) instead of buffering and decoding it. stderr is kept
+        # for reporting failures.
         timeout_val = None if timeout == -1 else timeout
-        result = subprocess.run(
+        subprocess.run(
             rocprof_cmd,
             check=True,
-            capture_output=True,
-            text=True,
+            stdout=None if verbose else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
             timeout=timeout_val,
         )
 
-        if verbose and result.stdout:
-            print(result.stdout)
-
         stats = parse_rocprof_csv(cmd_output_dir, iter_count)
-        print(
-            f">>> Stats: min={stats.min:.2f}(us), max={stats.max:.2f}(us), mean={stats.mean:.2f}(us), iter={stats.iter}, dispatch_count={stats.dispatch_count}"
-        )
+        if not isinstance(stats.mean, float):
+            if verbose:
+                print(">>> No kernel dispatches found in rocprof output")
+            return CommandResult(TimingStats(), failed=True)
 
         return CommandResult(stats, succeeded=True)
 
@@ -196,7 +308,7 @@ def run_profiled_command(
         if verbose:
             print(f">>> Command failed with exit code {e.returncode}")
             if e.stderr:
-                print(f">>> stderr: {e.stderr}")
+                print(f">>> stderr: {e.stderr.decode(errors='replace')}")
         return CommandResult(TimingStats(), failed=True)
     except Exception as e:
         if verbose:
@@ -208,6 +320,376 @@ def run_profiled_command(
             tmpdir_context.__exit__(None, None, None)
 
 
+def run_batch_session(
+    batch: list[tuple[str, int]],
+    rocprof: RocprofInvocation,
+    session_output_dir: str,
+    verbose: bool,
+    timeout: int,
+) -> list[tuple[CommandResult, str] | None]:
+    # Runs every (command, iter_count) pair inside a single rocprofv3 session
+    # using the driver's --batch mode. The driver reports the start/end
+    # timestamps of each configuration, which are used to attribute kernel
+    # dispatches to commands. Each result is paired with the reason it did not
+    # succeed (empty on success), to be reported next to its command. Commands
+    # that have to be run again in a new session are returned as None.
+    results: list[tuple[CommandResult, str] | None] = [
+        (CommandResult(TimingStats(), failed=True), "No result from batch")
+    ] * len(batch)
+
+    try:
+        # The driver enforces the per-command timeout itself: it reports an
+        # overrunning command with BATCH_TIMEOUT_STATUS and exits right away.
+        os.makedirs(session_output_dir, exist_ok=True)
+        rocprof_cmd = build_rocprof_cmd(
+            rocprof,
+            session_output_dir,
+            ["--batch", "--timeout", str(timeout)],
+        )
+
+        if verbose:
+            print(f">>> {shlex.join(rocprof_cmd)} < ({len(batch)} commands)\n")
+
+        # Backstop in case the session as a whole wedges (e.g. during profiler
+        # teardown), with headroom for profiler startup.
+        timeout_val = None if timeout == -1 else timeout * (len(batch) + 1)
+        try:
+            result = subprocess.run(
+                rocprof_cmd,
+                input="".join(f"{command}\n" for command, _ in batch),
+                capture_output=True,
+                text=True,
+                timeout=timeout_val,
+            )
+        except subprocess.TimeoutExpired:
+            # rocprofv3 only writes its traces when the profiled process
+            # finalizes, so a killed session leaves nothing to attribute.
+            return [
+                (
+                    CommandResult(TimingStats(), timed_out=True),
+                    f"Batch session timed out after {timeout_val} seconds "
+                    "before rocprofv3 wrote its traces",
+                )
+            ] * len(batch)
+
+        if verbose and result.stdout:
+            print(result.stdout)
+        if verbose and result.returncode != 0:
+            print(f">>> Batch failed with exit code {result.returncode}")
+            if result.stderr:
+                print(f">>> stderr: {result.stderr}")
+
+        markers = [
+            line.split()[1:]
+            for line in result.stdout.splitlines()
+            if line.startswith(BATCH_DELIMITER)
+        ]
+        # After a timeout the driver exits without letting rocprofv3 finalize,
+        # so the commands that did not get a result here are run again.
+        cut_short = bool(markers) and markers[-1][0] == str(BATCH_TIMEOUT_STATUS)
+        dispatches = read_kernel_dispatches(session_output_dir)
+        dispatch_starts = [start for start, _ in dispatches]
+
+        for idx, (_, iter_count) in enumerate(batch):
+            if idx >= len(markers):
+                results[idx] = (
+                    None
+                    if cut_short
+                    else (
+                        CommandResult(TimingStats(), failed=True),
+                        "No batch marker (driver exited before this command)",
+                    )
+                )
+                continue
+            if markers[idx][0] == str(BATCH_TIMEOUT_STATUS):
+                results[idx] = (
+                    CommandResult(TimingStats(), timed_out=True),
+                    f"Command timed out after {timeout} seconds",
+                )
+                continue
+            if markers[idx][0] != "0":
+                results[idx] = (
+                    CommandResult(TimingStats(), failed=True),
+                    f"Command failed with exit code {markers[idx][0]}",
+                )
+                continue
+
+            cmd_start, cmd_end = (int(ts) for ts in markers[idx][1:3])
+            lo = bisect.bisect_left(dispatch_starts, cmd_start)
+            hi = bisect.bisect_right(dispatch_starts, cmd_end)
+            # Convert from nanoseconds to microseconds
+            durations = [
+                (end - start) / 1000.0
+                for start, end in dispatches[lo:hi]
+                if end <= cmd_end
+            ]
+            if not durations:
+                results[idx] = (
+                    None
+                    if cut_short
+                    else (
+                        CommandResult(TimingStats(), failed=True),
+                        "No kernel dispatches within the command's time window",
+                    )
+                )
+                continue
+
+            try:
+                stats = compute_timing_stats(durations, iter_count)
+            except Exception as e:
+                results[idx] = (
+                    CommandResult(TimingStats(), failed=True),
+                    f"Exception: {e}",
+                )
+                continue
+            results[idx] = (CommandResult(stats, succeeded=True), "")
+
+    except Exception as e:
+        results = [
+            (CommandResult(TimingStats(), failed=True), f"Exception: {e}")
+        ] * len(batch)
+
+    return results
+
+
+def run_profiled_batch(
+    batch: list[tuple[str, int]],
+    rocprof: RocprofInvocation,
+    batch_output_dir: str | None,
+    verbose: bool,
+    timeout: int,
+) -> list[tuple[CommandResult, str]]:
+    # Runs the batch in as few rocprofv3 sessions as possible. A session that
+    # stops at a timed-out command always settles that command, so every
+    # resumed session has fewer commands left to run.
+    results: list[tuple[CommandResult, str] | None] = [None] * len(batch)
+
+    # Use either temporary directory or persistent directory (created by main)
+    if batch_output_dir is None:
+        tmpdir_context = tempfile.TemporaryDirectory()
+        batch_output_dir = tmpdir_context.__enter__()
+    else:
+        tmpdir_context = None
+
+    try:
+        pending = list(range(len(batch)))
+        session_num = 0
+        while pending:
+            # Each session gets its own directory so that its traces are not
+            # mixed with those of earlier sessions.
+            session_results = run_batch_session(
+                [batch[idx] for idx in pending],
+                rocprof,
+                os.path.join(batch_output_dir, f"session_{session_num}"),
+                verbose,
+                timeout,
+            )
+            session_num += 1
+            for idx, session_result in zip(pending, session_results):
+                results[idx] = session_result
+            pending = [idx for idx in pending if results[idx] is None]
+            if verbose and pending:
+                print(
+                    f">>> Resuming {len(pending)} commands in a new rocprofv3 "
+                    "session"
+                )
+    finally:
+        # Cleanup temporary directory if used
+        if tmpdir_context is not None:
+            tmpdir_context.__exit__(None, None, None)
+
+    return results
+
+
+def run_batch(
+    commands: list[str],
+    rocprof: RocprofInvocation,
+    batch_output_dir: str | None,
+    verbose: bool,
+    timeout: int,
+) -> list[CommandResult]:
+    results: list[CommandResult | None] = [None] * len(commands)
+    reasons = [""] * len(commands)
+    batch = []
+    batch_indices = []
+    for idx, command in enumerate(commands):
+        driver_args = command.split()
+        if command.startswith(SKIP_PREFIX):
+            results[idx] = CommandResult(TimingStats(), skipped=True)
+        elif not driver_args:
+            results[idx] = CommandResult(TimingStats(), failed=True)
+            reasons[idx] = f"Failed to parse command: {command}"
+        else:
+            batch.append((command, get_iter_count(driver_args)))
+            batch_indices.append(idx)
+
+    if batch:
+        batch_results = run_profiled_batch(
+            batch, rocprof, batch_output_dir, verbose, timeout
+        )
+        for idx, (result, reason) in zip(batch_indices, batch_results):
+            results[idx] = result
+            reasons[idx] = reason
+
+    for cmd_num, (command, result, reason) in enumerate(
+        zip(commands, results, reasons), start=1
+    ):
+        if result.skipped:
+            print_banner(f"Skipping command {cmd_num}/{len(commands)}", command)
+        else:
+            print_banner(f"Batched command {cmd_num}/{len(commands)}", command)
+        if verbose and reason:
+            print(f">>> {reason}")
+        print_result(result)
+
+    return results
+
+
+def get_gpu_ids(num_gpus: int) -> list[str]:
+    # Map workers into the devices that are already visible, so an existing
+    # HIP_VISIBLE_DEVICES restriction is respected rather than overwritten.
+    visible = os.environ.get("HIP_VISIBLE_DEVICES")
+    if visible:
+        gpu_ids = [gpu_id.strip() for gpu_id in visible.split(",") if gpu_id.strip()]
+    else:
+        gpu_ids = [str(gpu_id) for gpu_id in range(num_gpus)]
+    return gpu_ids[:num_gpus]
+
+
+def init_gpu_worker(gpu_ids: "multiprocessing.Queue[str]") -> None:
+    # Each worker process claims a distinct GPU for its lifetime, so every
+    # rocprofv3 subprocess it launches inherits the pinned device.
+    os.environ["HIP_VISIBLE_DEVICES"] = gpu_ids.get()
+
+
+def run_profiled_command_captured(
+    command: str,
+    rocprof: RocprofInvocation,
+    cmd_output_dir: str | None,
+    verbose: bool,
+    timeout: int,
+) -> tuple[CommandResult, str]:
+    # Runs in a worker process. Everything written to stdout, including by the
+    # rocprofv3 subprocess, is captured and returned so that the main process
+    # can print it in command order instead of interleaving workers.
+    with tempfile.TemporaryFile("w+", errors="replace") as log:
+        sys.stdout.flush()
+        saved_stdout = os.dup(1)
+        os.dup2(log.fileno(), 1)
+        try:
+            result = run_profiled_command(
+                command, rocprof, cmd_output_dir, verbose, timeout
+            )
+            sys.stdout.flush()
+        finally:
+            os.dup2(saved_stdout, 1)
+            os.close(saved_stdout)
+        log.seek(0)
+        return result, log.read()
+
+
+def run_commands(
+    commands: list[str],
+    rocprof: RocprofInvocation,
+    cmd_output_dirs: list[str | None],
+    verbose: bool,
+    timeout: int,
+    gpu_ids: list[str],
+) -> Iterator[CommandResult]:
+    # Yields results in the same order as `commands`, regardless of the order
+    # in which they complete. With more than one GPU, commands run in a
+    # process pool and are reported here as their results are collected.
+    num_commands = len(commands)
+    with contextlib.ExitStack() as stack:
+        futures = [None] * num_commands
+        if len(gpu_ids) > 1:
+            gpu_id_queue = multiprocessing.Queue()
+            for gpu_id in gpu_ids:
+                gpu_id_queue.put(gpu_id)
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=len(gpu_ids),
+                    initializer=init_gpu_worker,
+                    initargs=(gpu_id_queue,),
+                )
+            )
+            futures = [
+                None
+                if command.startswith(SKIP_PREFIX)
+                else executor.submit(
+                    run_profiled_command_captured,
+                    command,
+                    rocprof,
+                    cmd_output_dir,
+                    verbose,
+                    timeout,
+                )
+                for command, cmd_output_dir in zip(commands, cmd_output_dirs)
+            ]
+
+        for cmd_num, (command, cmd_output_dir, future) in enumerate(
+            zip(commands, cmd_output_dirs, futures), start=1
+        ):
+            # Check if command should be skipped
+            if command.startswith(SKIP_PREFIX):
+                print_banner(f"Skipping command {cmd_num}/{num_commands}", command)
+                # Create a result with default (N.A.) stats for skipped commands
+                result = CommandResult(TimingStats(), skipped=True)
+            else:
+                print_banner(f"Running command {cmd_num}/{num_commands}", command)
+                if future is None:
+                    # Run the command and collect statistics
+                    result = run_profiled_command(
+                        command, rocprof, cmd_output_dir, verbose, timeout
+                    )
+                else:
+                    try:
+                        result, log = future.result()
+                    except Exception as e:
+                        # e.g. BrokenProcessPool if a worker process died; the
+                        # remaining futures fail the same way, so every command
+                        # is still reported and written to the CSV.
+                        if verbose:
+                            print(f">>> Worker exception: {e!r}")
+                        result = CommandResult(TimingStats(), failed=True)
+                    else:
+                        print(log, end="")
+            print_result(result)
+            yield result
+
+
+def is_timing_excluded_arg(arg: str) -> bool:
+    # Also match the "--flag=value" spelling.
+    flag = arg.split("=")[0]
+    return flag in API_TRACE_ARGS or any(
+        flag == prefix or flag.startswith(f"{prefix}-")
+        for prefix in COUNTER_ARG_PREFIXES
+    )
+
+
+def get_rocprof_args(rocprof_args: str, profile_mode: str) -> list[str]:
+    args = rocprof_args.split() if rocprof_args else ["--kernel-trace"]
+    if profile_mode == "timing":
+        # Drop excluded options along with their values (e.g. the counter
+        # names following --pmc, or "False" in "--runtime-trace False").
+        kept = []
+        stripped = []
+        dropping = False
+        for arg in args:
+            if arg.startswith("-"):
+                dropping = is_timing_excluded_arg(arg)
+            (stripped if dropping else kept).append(arg)
+        if stripped:
+            print(
+                f"Note: ignoring {' '.join(stripped)} in timing mode; "
+                "use --profile-mode counters to keep them."
+            )
+        args = kept
+        if "--kernel-trace" not in args:
+            args.append("--kernel-trace")
+    return args
+
+
 def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="""
@@ -227,6 +709,15 @@ The script will:
   2. Apply timeout to each command (default: 60 seconds)
   3. Extract timing statistics from rocprof CSV outputs
   4. Aggregate results into a single output CSV
+
+With --num-gpus N, up to N commands run concurrently, each pinned to its own
+GPU through HIP_VISIBLE_DEVICES. If HIP_VISIBLE_DEVICES is already set, the
+GPUs are taken from that list. Results are still reported in input order.
+
+With --batch, all commands run inside a single rocprofv3 session (the driver
+reads them from stdin), paying the profiler startup cost only once. The driver
+enforces the timeout per command: a command that exceeds it is reported as
+timed out, and the rest of the batch runs in a new rocprofv3 session.
         """,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
@@ -271,8 +762,24 @@ The script will:
         "--rocprof-args",
         "-r",
         type=str,
-        default="--runtime-trace",
-        help="Arguments for rocprofv3 (default: --runtime-trace)",
+        default="--kernel-trace",
+        help="Arguments for rocprofv3 (default: --kernel-trace). Only kernel "
+        "timestamps are used; API tracing and counter collection options such "
+        "as --runtime-trace or --pmc are dropped unless --profile-mode counters "
+        "is also given.",
+    )
+
+    parser.add_argument(
+        "--profile-mode",
+        "-m",
+        type=str,
+        choices=PROFILE_MODES,
+        default="timing",
+        help="'timing' (default) collects only kernel traces: API tracing and "
+        "counter collection options are stripped from --rocprof-args and "
+        "--kernel-trace is added, as they serialize dispatches and inflate the "
+        "timings of short kernels. 'counters' passes --rocprof-args through unchanged for full "
+        "instrumentation.",
     )
 
     parser.add_argument(
@@ -290,6 +797,21 @@ The script will:
         help="Timeout in seconds for each command (default: 30, use -1 for no timeout)",
     )
 
+    parser.add_argument(
+        "--num-gpus",
+        "-n",
+        type=int,
+        default=1,
+        help="Number of GPUs to run commands on concurrently (default: 1)",
+    )
+
+    parser.add_argument(
+        "--batch",
+        "-b",
+        action="store_true",
+        help="Run all commands in a single rocprofv3 session",
+    )
+
     return parser
 
 
@@ -297,6 +819,18 @@ def main():
     parser = get_parser()
     args = parser.parse_args()
 
+    if args.num_gpus < 1:
+        parser.error("--num-gpus must be at least 1")
+    if args.batch and args.num_gpus > 1:
+        parser.error("--batch cannot be combined with --num-gpus > 1")
+
+    gpu_ids = get_gpu_ids(args.num_gpus) if args.num_gpus > 1 else []
+    if args.num_gpus > 1 and len(gpu_ids) < args.num_gpus:
+        parser.error(
+            f"--num-gpus {args.num_gpus} exceeds the {len(gpu_ids)} devices in "
+            "HIP_VISIBLE_DEVICES"
+        )
+
     commands_file = Path(args.commands_file)
     if not commands_file.exists():
         print(f"Error: Commands file not found: {commands_file}")
@@ -321,11 +855,10 @@ def main():
         output_dir = Path(args.output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
 
-    rocprof_args = (
-        args.rocprof_args.split() if args.rocprof_args else ["--runtime-trace"]
-    )
+    rocprof_args = get_rocprof_args(args.rocprof_args, args.profile_mode)
 
     if args.verbose:
+        print(f"Profile mode: {args.profile_mode}")
         print(f"Rocprof args: {' '.join(rocprof_args)}")
         if output_dir is None:
             print("Using temporary directories (auto-cleanup)")
@@ -333,16 +866,15 @@ def main():
             print(f"Output directory: {output_dir.absolute()}")
         timeout_str = "no timeout" if args.timeout == -1 else f"{args.timeout} seconds"
         print(f"Timeout: {timeout_str}")
+        print(f"GPUs: {args.num_gpus}")
         print(f"Results will be written to: {args.csv}\n")
 
-    csv_file = csv.writer(open(args.csv, "w", newline=""))
     csv_headers = ["command"]
     for metric in ALL_METRICS:
         if metric in ["min", "max", "mean", "stddev"]:
             csv_headers.append(f"{metric} (us)")
         else:
             csv_headers.append(metric)
-    csv_file.writerow(csv_headers)
 
     cmd_count = 0
     success_count = 0
@@ -350,57 +882,78 @@ def main():
     skipped_count = 0
     timeout_count = 0
 
-    for command in commands:
-        cmd_count += 1
-
-        # Check if command should be skipped
-        skip_prefix = "[SKIP]"
-        is_skipped = command.startswith(skip_prefix)
-
-        if is_skipped:
-            display_command = command[len(skip_prefix) :].strip()
-            print(f"\n{'='*80}")
-            print(f"Skipping command {cmd_count}/{len(commands)}:\n{display_command}")
-            print(f"{'='*80}")
-            # Create a result with default (N.A.) stats for skipped commands
-            result = CommandResult(TimingStats(), skipped=True)
+    # Precompute the invariant part of the rocprofv3 command line and create
+    # the rocprof output directories up front, so the per-command work is
+    # limited to running and parsing.
+    rocprof = RocprofInvocation(
+        head=["rocprofv3", "--output-format", "csv"],
+        tail=[*rocprof_args, "--", args.driver],
+    )
+    if args.batch:
+        batch_output_dir = None
+        if output_dir is not None:
+            batch_output_dir = str(output_dir / "batch")
+            os.makedirs(batch_output_dir, exist_ok=True)
+        results = run_batch(
+            commands,
+            rocprof,
+            batch_output_dir,
+            args.verbose,
+            args.timeout,
+        )
+    else:
+        cmd_output_dirs: list[str | None] = [None] * len(commands)
+        if output_dir is not None:
+            for idx, command in enumerate(commands):
+                if not command.startswith(SKIP_PREFIX):
+                    cmd_output_dirs[idx] = str(output_dir / f"command_{idx + 1}")
+                    os.makedirs(cmd_output_dirs[idx], exist_ok=True)
+        results = run_commands(
+            commands,
+            rocprof,
+            cmd_output_dirs,
+            args.verbose,
+            args.timeout,
+            gpu_ids,
+        )
 
-        else:
-            print(f"\n{'='*80}")
-            print(f"Running command {cmd_count}/{len(commands)}:\n{command}")
-            print(f"{'='*80}")
-            # Run the command and collect statistics
-            result = run_profiled_command(
-                command,
-                args.driver,
-                output_dir,
-                rocprof_args,
-                args.verbose,
-                cmd_count,
-                args.timeout,
-            )
+    with open(args.csv, "w", newline="", buffering=CSV_BUFFER_SIZE) as f:
+        csv_file = csv.writer(f)
+        csv_file.writerow(csv_headers)
+        csv_rows = []
 
-        stats = result.stats
-        csv_row = [command]
-        for metric in ALL_METRICS:
-            value = getattr(stats, metric)
-            csv_row.append(f"{value:.2f}" if isinstance(value, float) else str(value))
-        csv_file.writerow(csv_row)
-
-        if result.succeeded:
-            assert isinstance(stats.mean, float)
-            success_count += 1
-        elif result.skipped:
-            print(">>> Skipped")
-            skipped_count += 1
-        elif result.timed_out:
-            print(f">>> Timed out")
-            timeout_count += 1
-        elif result.failed:
-            print(">>> Failed")
-            failed_count += 1
-        else:
-            raise RuntimeError(f"Unknown result: {result}")
+        # Rows collected since the last flush are written out even if the run
+        # is interrupted (e.g. Ctrl-C) or a command raises.
+        try:
+            for command, result in zip(commands, results):
+                cmd_count += 1
+
+                stats = result.stats
+                csv_row = [command]
+                for metric in ALL_METRICS:
+                    value = getattr(stats, metric)
+                    csv_row.append(
+                        f"{value:.2f}" if isinstance(value, float) else str(value)
+                    )
+                csv_rows.append(csv_row)
+
+                # Flush periodically so partial results survive an interrupted run.
+                if len(csv_rows) >= CSV_FLUSH_INTERVAL:
+                    csv_file.writerows(csv_rows)
+                    f.flush()
+                    csv_rows.clear()
+
+                if result.succeeded:
+                    assert isinstance(stats.mean, float)
+                    success_count += 1
+                elif result.skipped:
+                    skipped_count += 1
+                elif result.timed_out:
+                    timeout_count += 1
+                elif result.failed:
+                    failed_count += 1
+        finally:
+            csv_file.writerows(csv_rows)
 
     print(f"\n{'='*80}")
     print("SUMMARY")